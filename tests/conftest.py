@@ -487,6 +487,8 @@ class _MockRedis:
         if not self.cache:
             self.cache = dict()
 
+        self.ttls = dict()
+
     def __enter__(self):
         return self
 
@@ -494,7 +496,8 @@ class _MockRedis:
         pass
 
     def delete(self, key):
-        del self.cache[key]
+        self.cache.pop(key, None)
+        self.ttls.pop(key, None)
 
     def execute(self):
         pass
@@ -502,8 +505,9 @@ class _MockRedis:
     def exists(self, key):
         return key in self.cache
 
-    def expire(self, _key, _seconds):
-        pass
+    def expire(self, key, seconds):
+        if key in self.cache:
+            self.ttls[key] = seconds
 
     def from_url(self, _url):
         return self
@@ -514,28 +518,75 @@ class _MockRedis:
         except KeyError:
             return None
 
-    def hset(self, hash_, key, value, *_args, **_kwargs):
+    def hgetall(self, hash_):
+        # Like Redis, field names come back as bytes.
+        return {
+            key.encode() if isinstance(key, str) else key: value
+            for key, value in self.cache.get(hash_, {}).items()
+        }
+
+    def hset(self, hash_, key=None, value=None, *_args, mapping=None, **_kwargs):
         if hash_ not in self.cache:
             self.cache[hash_] = dict()
-        self.cache[hash_][key] = value
+        if key is not None:
+            self.cache[hash_][key] = value
+        if mapping is not None:
+            self.cache[hash_].update(mapping)
 
     def get(self, key):
         return self.cache.get(key)
 
-    def pipeline(self):
-        return self
+    def pipeline(self, transaction=True):
+        return _MockRedisPipeline(self)
 
     def scan_iter(self, search, count):
         del count  # unused
         return [key for key in self.cache.keys() if re.search(search, key)]
 
-    def set(self, key, value):
+    def set(self, key, value, ex=None):
         self.cache[key] = value
+        if ex is not None:
+            self.ttls[key] = ex
+
+    def ttl(self, key):
+        if key not in self.cache:
+            return -2
+        return self.ttls.get(key, -1)
 
     def setex(self, key, value, _seconds):
         self.cache[key] = value
 
 
+class _MockRedisPipeline:
+    """
+    Just enough of a Redis pipeline for our tests.
+    Commands are applied immediately; `execute` returns their results.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def _pipelined(*args, **kwargs):
+            self.results.append(command(*args, **kwargs))
+            return self
+
+        return _pipelined
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
 @pytest.fixture
 def mockredis():
     mock_redis = _MockRedis()
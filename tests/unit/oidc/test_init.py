@@ -0,0 +1,55 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pretend
+
+from celery.schedules import crontab
+
+from warehouse import oidc
+from warehouse.oidc.interfaces import IOIDCProviderService
+from warehouse.oidc.services import OIDCProviderService, OIDCProviderServiceFactory
+from warehouse.oidc.tasks import refresh_oidc_jwks
+from warehouse.oidc.utils import GITHUB_OIDC_ISSUER_URL
+
+
+def test_includeme():
+    config = pretend.stub(
+        registry=pretend.stub(
+            settings={"oidc.backend": "warehouse.oidc.services.OIDCProviderService"}
+        ),
+        maybe_dotted=pretend.call_recorder(lambda dotted: OIDCProviderService),
+        register_service_factory=pretend.call_recorder(lambda *a, **kw: None),
+        add_periodic_task=pretend.call_recorder(lambda *a: None),
+        get_settings=lambda: {"auth.domain": "auth"},
+        add_route=pretend.call_recorder(lambda *a, **kw: None),
+    )
+
+    oidc.includeme(config)
+
+    assert config.register_service_factory.calls == [
+        pretend.call(
+            OIDCProviderServiceFactory(
+                provider="github",
+                issuer_url=GITHUB_OIDC_ISSUER_URL,
+                service_class=OIDCProviderService,
+            ),
+            IOIDCProviderService,
+            name="github",
+        )
+    ]
+    assert config.add_periodic_task.calls == [
+        pretend.call(crontab(minute="*/5"), refresh_oidc_jwks)
+    ]
+    assert config.add_route.calls == [
+        pretend.call("oidc.mint_token", "/_/oidc/github/mint-token", domain="auth")
+    ]
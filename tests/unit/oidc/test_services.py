@@ -10,8 +10,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import threading
+
+import msgpack
+import orjson
 import pretend
 import pytest
+import requests
 
 from jwt import PyJWK, PyJWTError
 from zope.interface.verify import verifyClass
@@ -19,6 +25,32 @@ from zope.interface.verify import verifyClass
 from warehouse.oidc import interfaces, services
 
 
+def _clear_caches():
+    services._redis_client.cache_clear()
+    services.OIDCProviderService._local_keysets.clear()
+    services.OIDCProviderService._pyjwks.clear()
+    services.OIDCProviderService._missing_key_ids.clear()
+    services.OIDCProviderService._refresh_attempts.clear()
+    services.OIDCProviderService._refresh_locks.clear()
+
+
+@pytest.fixture(autouse=True)
+def _clear_process_caches():
+    _clear_caches()
+    yield
+    _clear_caches()
+
+
+def test_redis_client_is_shared(monkeypatch):
+    client = pretend.stub()
+    strict_redis = pretend.stub(from_url=pretend.call_recorder(lambda url: client))
+    monkeypatch.setattr(services.redis, "StrictRedis", strict_redis)
+
+    assert services._redis_client("rediss://fake.example.com") is client
+    assert services._redis_client("rediss://fake.example.com") is client
+    assert strict_redis.from_url.calls == [pretend.call("rediss://fake.example.com")]
+
+
 def test_oidc_provider_service_factory():
     factory = services.OIDCProviderServiceFactory(
         provider="example", issuer_url="https://example.com"
@@ -31,8 +63,12 @@ def test_oidc_provider_service_factory():
     metrics = pretend.stub()
     request = pretend.stub(
         db=pretend.stub(),
+        http=pretend.stub(),
         registry=pretend.stub(
-            settings={"oidc.jwk_cache_url": "rediss://another.example.com"}
+            settings={
+                "oidc.jwk_cache_url": "rediss://another.example.com",
+                "http": {"verify": "/etc/ssl/certs/"},
+            }
         ),
         find_service=lambda *a, **kw: metrics,
     )
@@ -44,12 +80,37 @@ def test_oidc_provider_service_factory():
     assert service.issuer_url == factory.issuer_url
     assert service.cache_url == "rediss://another.example.com"
     assert service.metrics == metrics
+    assert service.http == request.http
+    assert service.http_settings == {"verify": "/etc/ssl/certs/"}
 
+    assert factory == factory
     assert factory != object()
     assert factory != services.OIDCProviderServiceFactory(
         provider="another", issuer_url="https://foo.example.com"
     )
 
+    same_factory = services.OIDCProviderServiceFactory(
+        provider="example", issuer_url="https://example.com"
+    )
+    assert factory == same_factory
+    assert hash(factory) == hash(same_factory)
+
+
+@pytest.mark.parametrize(
+    ("headers", "cooldown"),
+    [
+        ({}, services.KEYSET_REFRESH_COOLDOWN),
+        ({"Cache-Control": "no-store"}, services.KEYSET_REFRESH_COOLDOWN),
+        ({"Cache-Control": "max-age=bogus"}, services.KEYSET_REFRESH_COOLDOWN),
+        ({"Cache-Control": "max-age=\u00b2"}, services.KEYSET_REFRESH_COOLDOWN),
+        ({"Cache-Control": "max-age=0"}, services.KEYSET_REFRESH_COOLDOWN),
+        ({"Cache-Control": "public, Max-Age=120, must-revalidate"}, 120),
+        ({"Cache-Control": "max-age=86400"}, services.KEYSET_MAX_REFRESH_COOLDOWN),
+    ],
+)
+def test_refresh_cooldown(headers, cooldown):
+    assert services._refresh_cooldown(headers) == cooldown
+
 
 class TestOIDCProviderService:
     def test_interface_matches(self):
@@ -64,6 +125,8 @@ class TestOIDCProviderService:
             issuer_url=pretend.stub(),
             cache_url=pretend.stub(),
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         token = pretend.stub()
@@ -95,6 +158,95 @@ class TestOIDCProviderService:
             )
         ]
 
+    def test_verify_jwt_signatures(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="fakeprovider",
+            issuer_url=pretend.stub(),
+            cache_url=pretend.stub(),
+            metrics=pretend.stub(
+                increment=pretend.call_recorder(lambda *a, **kw: None)
+            ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        key_ids = {"token-1": "key-1", "token-2": "key-2", "token-3": "key-1"}
+        monkeypatch.setattr(
+            service, "_get_key_id_for_token", lambda token: key_ids[token]
+        )
+        monkeypatch.setattr(
+            service, "_get_key", pretend.call_recorder(lambda key_id: f"{key_id}!")
+        )
+
+        def decode(token, key, **kwargs):
+            if token == "token-2":
+                raise PyJWTError
+            return {"token": token, "key": key}
+
+        monkeypatch.setattr(
+            services, "jwt", pretend.stub(decode=decode, PyJWTError=PyJWTError)
+        )
+
+        assert service.verify_jwt_signatures(["token-1", "token-2", "token-3"]) == [
+            {"token": "token-1", "key": "key-1!"},
+            None,
+            {"token": "token-3", "key": "key-1!"},
+        ]
+        assert service._get_key.calls == [pretend.call("key-1"), pretend.call("key-2")]
+        assert service.metrics.increment.calls == [
+            pretend.call(
+                "warehouse.oidc.verify_jwt_signature.invalid_signature",
+                tags=["provider:fakeprovider"],
+            )
+        ]
+
+    def test_verify_jwt_signatures_malformed_tokens(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="fakeprovider",
+            issuer_url=pretend.stub(),
+            cache_url=pretend.stub(),
+            metrics=pretend.stub(
+                increment=pretend.call_recorder(lambda *a, **kw: None)
+            ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        def _token(header):
+            encoded = base64.urlsafe_b64encode(orjson.dumps(header)).rstrip(b"=")
+            return f"{encoded.decode()}.e30.c2ln"
+
+        valid = _token({"alg": "RS256", "kid": "key-1"})
+        no_kid = _token({"alg": "RS256"})
+
+        monkeypatch.setattr(
+            service, "_get_key", pretend.call_recorder(lambda key_id: f"{key_id}!")
+        )
+        monkeypatch.setattr(
+            service,
+            "_verify_jwt_signature_with_key",
+            lambda token, key: {"token": token, "key": key},
+        )
+
+        assert service.verify_jwt_signatures([valid, "garbage", no_kid]) == [
+            {"token": valid, "key": "key-1!"},
+            None,
+            None,
+        ]
+        assert service._get_key.calls == [pretend.call("key-1")]
+        assert (
+            service.metrics.increment.calls
+            == [
+                pretend.call(
+                    "warehouse.oidc.verify_jwt_signature.invalid_signature",
+                    tags=["provider:fakeprovider"],
+                ),
+            ]
+            * 2
+        )
+
     @pytest.mark.parametrize("exc", [PyJWTError, ValueError])
     def test_verify_jwt_signature_fails(self, monkeypatch, exc):
         service = services.OIDCProviderService(
@@ -105,6 +257,8 @@ class TestOIDCProviderService:
             metrics=pretend.stub(
                 increment=pretend.call_recorder(lambda *a, **kw: None)
             ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         token = pretend.stub()
@@ -131,6 +285,8 @@ class TestOIDCProviderService:
             metrics=pretend.stub(
                 increment=pretend.call_recorder(lambda *a, **kw: None)
             ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         token = pretend.stub()
@@ -162,6 +318,8 @@ class TestOIDCProviderService:
             metrics=pretend.stub(
                 increment=pretend.call_recorder(lambda *a, **kw: None)
             ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         find_provider_by_issuer = pretend.call_recorder(lambda *a: None)
@@ -191,6 +349,8 @@ class TestOIDCProviderService:
             metrics=pretend.stub(
                 increment=pretend.call_recorder(lambda *a, **kw: None)
             ),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         provider = pretend.stub(verify_claims=pretend.call_recorder(lambda c: False))
@@ -220,14 +380,17 @@ class TestOIDCProviderService:
             issuer_url=pretend.stub(),
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
-        keys, timeout = service._get_keyset()
+        keys, timeout, stale = service._get_keyset()
 
         assert not keys
         assert timeout is False
+        assert stale is True
 
     def test_get_keyset_cached(self, monkeypatch, mockredis):
         service = services.OIDCProviderService(
@@ -236,16 +399,19 @@ class TestOIDCProviderService:
             issuer_url=pretend.stub(),
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
         keyset = {"fake-key-id": {"foo": "bar"}}
         service._store_keyset(keyset)
-        keys, timeout = service._get_keyset()
+        keys, timeout, stale = service._get_keyset()
 
         assert keys == keyset
         assert timeout is True
+        assert stale is False
 
     def test_refresh_keyset_timeout(self, monkeypatch, mockredis):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
@@ -255,6 +421,8 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
@@ -270,6 +438,87 @@ class TestOIDCProviderService:
             )
         ]
 
+    def test_refresh_keyset_recently_attempted(self, monkeypatch, mockredis):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        now = 1000.0
+        monkeypatch.setattr(services.time, "monotonic", lambda: now)
+
+        session = pretend.stub(
+            get=pretend.call_recorder(lambda url, timeout: pretend.stub(ok=False))
+        )
+        service.http = session
+        monkeypatch.setattr(
+            services, "sentry_sdk", pretend.stub(capture_message=lambda msg: None)
+        )
+
+        # The first attempt fails, and the next one within the cooldown is
+        # skipped, even though no timeout was stored in Redis.
+        assert service._refresh_keyset() == {}
+        assert service._refresh_keyset() == {}
+        assert len(session.get.calls) == 1
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.oidc.refresh_keyset.timeout", tags=["provider:example"]
+            )
+        ]
+
+        now += services.KEYSET_REFRESH_COOLDOWN
+        assert service._refresh_keyset() == {}
+        assert len(session.get.calls) == 2
+
+    def test_get_keyset_cached_timeout_elapsed(self, monkeypatch, mockredis):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url=pretend.stub(),
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        keyset = {"fake-key-id": {"foo": "bar"}}
+        service._store_keyset(keyset)
+
+        redis_key = "/warehouse/oidc/jwks/example/by-kid"
+        assert {
+            key_id: msgpack.unpackb(key)
+            for key_id, key in mockredis.cache[redis_key].items()
+        } == keyset
+        assert mockredis.ttls[redis_key] == (
+            services.KEYSET_REFRESH_COOLDOWN + services.KEYSET_STALE_TTL
+        )
+
+        # Simulate the cooldown passing, leaving only the stale period.
+        mockredis.ttls[redis_key] = services.KEYSET_STALE_TTL
+        keys, timeout, stale = service._get_keyset()
+
+        assert keys == keyset
+        assert timeout is False
+        assert stale is False
+
+        # Simulate the keyset nearing its expiry.
+        mockredis.ttls[redis_key] = 60
+        keys, timeout, stale = service._get_keyset()
+
+        assert keys == keyset
+        assert timeout is False
+        assert stale is True
+
     def test_refresh_keyset_oidc_config_fails(self, monkeypatch, mockredis):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
         service = services.OIDCProviderService(
@@ -278,25 +527,30 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
-        requests = pretend.stub(
-            get=pretend.call_recorder(lambda url: pretend.stub(ok=False))
+        session = pretend.stub(
+            get=pretend.call_recorder(lambda url, timeout: pretend.stub(ok=False))
         )
         sentry_sdk = pretend.stub(
             capture_message=pretend.call_recorder(lambda msg: pretend.stub())
         )
-        monkeypatch.setattr(services, "requests", requests)
+        service.http = session
         monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
 
         keys = service._refresh_keyset()
 
         assert keys == {}
         assert metrics.increment.calls == []
-        assert requests.get.calls == [
-            pretend.call("https://example.com/.well-known/openid-configuration")
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            )
         ]
         assert sentry_sdk.capture_message.calls == [
             pretend.call(
@@ -305,6 +559,49 @@ class TestOIDCProviderService:
             )
         ]
 
+    def test_refresh_keyset_oidc_config_request_fails(self, monkeypatch, mockredis):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        session = pretend.stub(
+            get=pretend.call_recorder(
+                pretend.raiser(requests.Timeout("read timed out"))
+            )
+        )
+        sentry_sdk = pretend.stub(
+            capture_message=pretend.call_recorder(lambda msg: pretend.stub())
+        )
+        service.http = session
+        monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
+
+        keys = service._refresh_keyset()
+
+        assert keys == {}
+        assert metrics.increment.calls == []
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            )
+        ]
+        assert sentry_sdk.capture_message.calls == [
+            pretend.call(
+                "OIDC provider example failed to return configuration: "
+                "https://example.com/.well-known/openid-configuration "
+                "(read timed out)"
+            )
+        ]
+
     def test_refresh_keyset_oidc_config_no_jwks_uri(self, monkeypatch, mockredis):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
         service = services.OIDCProviderService(
@@ -313,27 +610,32 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
-        requests = pretend.stub(
+        session = pretend.stub(
             get=pretend.call_recorder(
-                lambda url: pretend.stub(ok=True, json=lambda: {})
+                lambda url, timeout: pretend.stub(ok=True, content=b"{}")
             )
         )
         sentry_sdk = pretend.stub(
             capture_message=pretend.call_recorder(lambda msg: pretend.stub())
         )
-        monkeypatch.setattr(services, "requests", requests)
+        service.http = session
         monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
 
         keys = service._refresh_keyset()
 
         assert keys == {}
         assert metrics.increment.calls == []
-        assert requests.get.calls == [
-            pretend.call("https://example.com/.well-known/openid-configuration")
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            )
         ]
         assert sentry_sdk.capture_message.calls == [
             pretend.call(
@@ -350,38 +652,48 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
         openid_resp = pretend.stub(
             ok=True,
-            json=lambda: {
-                "jwks_uri": "https://example.com/.well-known/jwks.json",
-            },
+            content=orjson.dumps(
+                {
+                    "jwks_uri": "https://example.com/.well-known/jwks.json",
+                }
+            ),
         )
         jwks_resp = pretend.stub(ok=False)
 
-        def get(url):
+        def get(url, timeout):
             if url == "https://example.com/.well-known/jwks.json":
                 return jwks_resp
             else:
                 return openid_resp
 
-        requests = pretend.stub(get=pretend.call_recorder(get))
+        session = pretend.stub(get=pretend.call_recorder(get))
         sentry_sdk = pretend.stub(
             capture_message=pretend.call_recorder(lambda msg: pretend.stub())
         )
-        monkeypatch.setattr(services, "requests", requests)
+        service.http = session
         monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
 
         keys = service._refresh_keyset()
 
         assert keys == {}
         assert metrics.increment.calls == []
-        assert requests.get.calls == [
-            pretend.call("https://example.com/.well-known/openid-configuration"),
-            pretend.call("https://example.com/.well-known/jwks.json"),
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            ),
+            pretend.call(
+                "https://example.com/.well-known/jwks.json",
+                timeout=services.HTTP_TIMEOUT,
+            ),
         ]
         assert sentry_sdk.capture_message.calls == [
             pretend.call(
@@ -390,6 +702,62 @@ class TestOIDCProviderService:
             )
         ]
 
+    def test_refresh_keyset_jwks_request_fails(self, monkeypatch, mockredis):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        openid_resp = pretend.stub(
+            ok=True,
+            content=orjson.dumps(
+                {
+                    "jwks_uri": "https://example.com/.well-known/jwks.json",
+                }
+            ),
+        )
+
+        def get(url, timeout):
+            if url == "https://example.com/.well-known/jwks.json":
+                raise requests.ConnectionError("connection refused")
+            else:
+                return openid_resp
+
+        session = pretend.stub(get=pretend.call_recorder(get))
+        sentry_sdk = pretend.stub(
+            capture_message=pretend.call_recorder(lambda msg: pretend.stub())
+        )
+        monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
+
+        keys = service._fetch_keyset(http=session)
+
+        assert keys == {}
+        assert metrics.increment.calls == []
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            ),
+            pretend.call(
+                "https://example.com/.well-known/jwks.json",
+                timeout=services.HTTP_TIMEOUT,
+            ),
+        ]
+        assert sentry_sdk.capture_message.calls == [
+            pretend.call(
+                "OIDC provider example failed to return JWKS JSON: "
+                "https://example.com/.well-known/jwks.json (connection refused)"
+            )
+        ]
+
     def test_refresh_keyset_oidc_config_no_jwks_keys(self, monkeypatch, mockredis):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
         service = services.OIDCProviderService(
@@ -398,38 +766,48 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
         openid_resp = pretend.stub(
             ok=True,
-            json=lambda: {
-                "jwks_uri": "https://example.com/.well-known/jwks.json",
-            },
+            content=orjson.dumps(
+                {
+                    "jwks_uri": "https://example.com/.well-known/jwks.json",
+                }
+            ),
         )
-        jwks_resp = pretend.stub(ok=True, json=lambda: {})
+        jwks_resp = pretend.stub(ok=True, content=b"{}")
 
-        def get(url):
+        def get(url, timeout):
             if url == "https://example.com/.well-known/jwks.json":
                 return jwks_resp
             else:
                 return openid_resp
 
-        requests = pretend.stub(get=pretend.call_recorder(get))
+        session = pretend.stub(get=pretend.call_recorder(get))
         sentry_sdk = pretend.stub(
             capture_message=pretend.call_recorder(lambda msg: pretend.stub())
         )
-        monkeypatch.setattr(services, "requests", requests)
+        service.http = session
         monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
 
         keys = service._refresh_keyset()
 
         assert keys == {}
         assert metrics.increment.calls == []
-        assert requests.get.calls == [
-            pretend.call("https://example.com/.well-known/openid-configuration"),
-            pretend.call("https://example.com/.well-known/jwks.json"),
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            ),
+            pretend.call(
+                "https://example.com/.well-known/jwks.json",
+                timeout=services.HTTP_TIMEOUT,
+            ),
         ]
         assert sentry_sdk.capture_message.calls == [
             pretend.call("OIDC provider example returned JWKS JSON but no keys")
@@ -443,47 +821,107 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
 
         openid_resp = pretend.stub(
             ok=True,
-            json=lambda: {
-                "jwks_uri": "https://example.com/.well-known/jwks.json",
-            },
+            content=orjson.dumps(
+                {
+                    "jwks_uri": "https://example.com/.well-known/jwks.json",
+                }
+            ),
         )
         jwks_resp = pretend.stub(
-            ok=True, json=lambda: {"keys": [{"kid": "fake-key-id", "foo": "bar"}]}
+            ok=True,
+            content=orjson.dumps({"keys": [{"kid": "fake-key-id", "foo": "bar"}]}),
+            headers={"Cache-Control": "public, max-age=120"},
         )
 
-        def get(url):
+        def get(url, timeout):
             if url == "https://example.com/.well-known/jwks.json":
                 return jwks_resp
             else:
                 return openid_resp
 
-        requests = pretend.stub(get=pretend.call_recorder(get))
+        session = pretend.stub(get=pretend.call_recorder(get))
         sentry_sdk = pretend.stub(
             capture_message=pretend.call_recorder(lambda msg: pretend.stub())
         )
-        monkeypatch.setattr(services, "requests", requests)
+        service.http = session
         monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
 
         keys = service._refresh_keyset()
 
         assert keys == {"fake-key-id": {"kid": "fake-key-id", "foo": "bar"}}
         assert metrics.increment.calls == []
-        assert requests.get.calls == [
-            pretend.call("https://example.com/.well-known/openid-configuration"),
-            pretend.call("https://example.com/.well-known/jwks.json"),
+        assert session.get.calls == [
+            pretend.call(
+                "https://example.com/.well-known/openid-configuration",
+                timeout=services.HTTP_TIMEOUT,
+            ),
+            pretend.call(
+                "https://example.com/.well-known/jwks.json",
+                timeout=services.HTTP_TIMEOUT,
+            ),
         ]
         assert sentry_sdk.capture_message.calls == []
 
         # Ensure that we also cached the updated keyset as part of refreshing.
-        keys, timeout = service._get_keyset()
+        keys, timeout, stale = service._get_keyset()
         assert keys == {"fake-key-id": {"kid": "fake-key-id", "foo": "bar"}}
         assert timeout is True
+        assert stale is False
+        assert mockredis.ttls["/warehouse/oidc/jwks/example/by-kid"] == (
+            120 + services.KEYSET_STALE_TTL
+        )
+
+    def test_refresh_keyset(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        refreshed = {"fake-key-id": {"foo": "baz"}}
+        monkeypatch.setattr(
+            service, "_fetch_keyset", pretend.call_recorder(lambda: refreshed)
+        )
+
+        assert service._refresh_keyset() == refreshed
+        assert service._fetch_keyset.calls == [pretend.call()]
+        assert not service._refresh_lock().locked()
+
+    def test_refresh_keyset_already_refreshing(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        cached = {"fake-key-id": {"foo": "bar"}}
+        monkeypatch.setattr(service, "_get_keyset", lambda: (cached, True, False))
+        monkeypatch.setattr(service, "_fetch_keyset", pretend.raiser(ValueError))
+
+        # Simulate another thread in the middle of a refresh, which finishes
+        # shortly after; we wait for it and use what it cached.
+        lock = service._refresh_lock()
+        lock.acquire()
+        threading.Timer(0.1, lock.release).start()
+
+        assert service._refresh_keyset() == cached
+        assert not lock.locked()
 
     def test_get_key_cached(self, monkeypatch):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
@@ -493,6 +931,8 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         keyset = {
@@ -507,7 +947,9 @@ class TestOIDCProviderService:
                 "x5t": "dummy",
             }
         }
-        monkeypatch.setattr(service, "_get_keyset", lambda: (keyset, True))
+        monkeypatch.setattr(
+            service, "_get_cached_key", lambda kid: (keyset[kid], False)
+        )
 
         key = service._get_key("fake-key-id")
         assert isinstance(key, PyJWK)
@@ -515,7 +957,7 @@ class TestOIDCProviderService:
 
         assert metrics.increment.calls == []
 
-    def test_get_key_uncached(self, monkeypatch):
+    def test_get_key_cached_stale(self, monkeypatch):
         metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
         service = services.OIDCProviderService(
             session=pretend.stub(),
@@ -523,6 +965,8 @@ class TestOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         keyset = {
@@ -537,60 +981,597 @@ class TestOIDCProviderService:
                 "x5t": "dummy",
             }
         }
-        monkeypatch.setattr(service, "_get_keyset", lambda: ({}, False))
-        monkeypatch.setattr(service, "_refresh_keyset", lambda: keyset)
+        monkeypatch.setattr(service, "_get_cached_key", lambda kid: (keyset[kid], True))
+        monkeypatch.setattr(service, "_refresh_keyset", pretend.raiser(ValueError))
+        monkeypatch.setattr(
+            service,
+            "_refresh_keyset_in_background",
+            pretend.call_recorder(lambda: None),
+        )
 
         key = service._get_key("fake-key-id")
         assert isinstance(key, PyJWK)
         assert key.key_id == "fake-key-id"
 
+        assert service._refresh_keyset_in_background.calls == [pretend.call()]
         assert metrics.increment.calls == []
 
-    def test_get_key_refresh_fails(self, monkeypatch):
-        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+    @pytest.mark.parametrize("stale", [True, False])
+    def test_refresh_stale_keyset(self, monkeypatch, stale):
         service = services.OIDCProviderService(
             session=pretend.stub(),
             provider="example",
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
-            metrics=metrics,
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
-        monkeypatch.setattr(service, "_get_keyset", lambda: ({}, False))
-        monkeypatch.setattr(service, "_refresh_keyset", lambda: {})
-
-        key = service._get_key("fake-key-id")
-        assert key is None
-
-        assert metrics.increment.calls == [
-            pretend.call(
-                "warehouse.oidc.get_key.error",
-                tags=["provider:example", "key_id:fake-key-id"],
-            )
-        ]
+        cached = {"fake-key-id": {"foo": "bar"}}
+        refreshed = {"fake-key-id": {"foo": "baz"}}
+        monkeypatch.setattr(service, "_get_keyset", lambda: (cached, False, stale))
+        monkeypatch.setattr(
+            service, "_refresh_keyset", pretend.call_recorder(lambda: refreshed)
+        )
 
-    def test_get_key_for_token(self, monkeypatch):
-        token = pretend.stub()
-        key = pretend.stub()
+        keys = service._refresh_stale_keyset()
+        if stale:
+            assert keys == refreshed
+            assert service._refresh_keyset.calls == [pretend.call()]
+        else:
+            assert keys == cached
+            assert service._refresh_keyset.calls == []
 
+    def test_refresh_keyset_in_background(self, monkeypatch):
         service = services.OIDCProviderService(
             session=pretend.stub(),
             provider="example",
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings={"verify": "/etc/ssl/certs/"},
         )
-        monkeypatch.setattr(service, "_get_key", pretend.call_recorder(lambda kid: key))
 
-        monkeypatch.setattr(
-            services.jwt,
-            "get_unverified_header",
-            pretend.call_recorder(lambda token: {"kid": "fake-key-id"}),
-        )
+        threads = []
 
-        assert service._get_key_for_token(token) == key
-        assert service._get_key.calls == [pretend.call("fake-key-id")]
-        assert services.jwt.get_unverified_header.calls == [pretend.call(token)]
+        class FakeThread:
+            def __init__(self, target, daemon):
+                self.target = target
+                self.daemon = daemon
+                threads.append(self)
+
+            def start(self):
+                pass
+
+        sessions = []
+
+        class FakeSession:
+            def __init__(self):
+                self.closed = False
+                sessions.append(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.closed = True
+
+        monkeypatch.setattr(services.threading, "Thread", FakeThread)
+        monkeypatch.setattr(services.requests, "Session", FakeSession)
+        monkeypatch.setattr(
+            service, "_fetch_keyset", pretend.call_recorder(lambda http: {})
+        )
+
+        service._refresh_keyset_in_background()
+        assert len(threads) == 1
+        assert threads[0].daemon
+
+        # A refresh is already running, so we don't start another.
+        service._refresh_keyset_in_background()
+        assert len(threads) == 1
+
+        # The refresh uses its own HTTP session, rather than the request's,
+        # and closes it once it's done.
+        threads[0].target()
+        assert service._fetch_keyset.calls == [pretend.call(http=sessions[0])]
+        assert sessions[0].verify == "/etc/ssl/certs/"
+        assert sessions[0].closed
+
+        # Once it's finished, another can be started.
+        service._refresh_keyset_in_background()
+        assert len(threads) == 2
+
+    def test_refresh_keyset_in_background_fails(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=None,
+        )
+
+        threads = []
+
+        class FakeThread:
+            def __init__(self, target, daemon):
+                self.target = target
+                threads.append(self)
+
+            def start(self):
+                pass
+
+        sentry_sdk = pretend.stub(capture_exception=pretend.call_recorder(lambda: None))
+        monkeypatch.setattr(services.threading, "Thread", FakeThread)
+        monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
+        monkeypatch.setattr(
+            service, "_fetch_keyset", pretend.raiser(ValueError("boom"))
+        )
+
+        # A failed refresh is reported, and doesn't hold onto the lock.
+        service._refresh_keyset_in_background()
+        threads[0].target()
+        assert sentry_sdk.capture_exception.calls == [pretend.call()]
+        assert not service._refresh_lock().locked()
+
+    def test_refresh_keyset_in_background_cannot_start(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        class FakeThread:
+            def __init__(self, target, daemon):
+                pass
+
+            def start(self):
+                raise RuntimeError("can't start new thread")
+
+        sentry_sdk = pretend.stub(capture_exception=pretend.call_recorder(lambda: None))
+        monkeypatch.setattr(services.threading, "Thread", FakeThread)
+        monkeypatch.setattr(services, "sentry_sdk", sentry_sdk)
+
+        service._refresh_keyset_in_background()
+        assert sentry_sdk.capture_exception.calls == [pretend.call()]
+        assert not service._refresh_lock().locked()
+
+    def test_get_key_uncached(self, monkeypatch):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        keyset = {
+            "fake-key-id": {
+                "kid": "fake-key-id",
+                "n": "ZHVtbXkK",
+                "kty": "RSA",
+                "alg": "RS256",
+                "e": "AQAB",
+                "use": "sig",
+                "x5c": ["dummy"],
+                "x5t": "dummy",
+            }
+        }
+        monkeypatch.setattr(service, "_get_cached_key", lambda kid: (None, True))
+        monkeypatch.setattr(service, "_refresh_keyset", lambda: keyset)
+
+        key = service._get_key("fake-key-id")
+        assert isinstance(key, PyJWK)
+        assert key.key_id == "fake-key-id"
+
+        assert metrics.increment.calls == []
+
+    def test_get_key_refresh_fails(self, monkeypatch):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(service, "_get_cached_key", lambda kid: (None, True))
+        monkeypatch.setattr(service, "_refresh_keyset", lambda: {})
+
+        key = service._get_key("fake-key-id")
+        assert key is None
+        assert service._is_missing_key_id("fake-key-id")
+
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.oidc.get_key.error",
+                tags=["provider:example", "key_id:fake-key-id"],
+            )
+        ]
+
+    def test_get_key_recently_missing(self, monkeypatch):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        service._set_missing_key_id("fake-key-id")
+        monkeypatch.setattr(
+            service,
+            "_get_cached_key",
+            pretend.call_recorder(lambda key_id: (None, False)),
+        )
+        monkeypatch.setattr(service, "_refresh_keyset", pretend.raiser(ValueError))
+
+        key = service._get_key("fake-key-id")
+        assert key is None
+
+        # The key ID is still looked up, but no refresh is attempted.
+        assert service._get_cached_key.calls == [pretend.call("fake-key-id")]
+
+        assert metrics.increment.calls == [
+            pretend.call(
+                "warehouse.oidc.get_key.error",
+                tags=["provider:example", "key_id:fake-key-id"],
+            )
+        ]
+
+    def test_get_key_recently_missing_stored_elsewhere(self, monkeypatch, mockredis):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+        monkeypatch.setattr(service, "_refresh_keyset", lambda: {})
+
+        assert service._get_key("fake-key-id") is None
+        assert service._is_missing_key_id("fake-key-id")
+
+        # Another process refreshes the keyset, picking up the new key.
+        jwk = {
+            "kid": "fake-key-id",
+            "n": "ZHVtbXkK",
+            "kty": "RSA",
+            "alg": "RS256",
+            "e": "AQAB",
+            "use": "sig",
+            "x5c": ["dummy"],
+            "x5t": "dummy",
+        }
+        mockredis.hset(
+            "/warehouse/oidc/jwks/example/by-kid",
+            mapping={"fake-key-id": msgpack.packb(jwk)},
+        )
+        mockredis.expire(
+            "/warehouse/oidc/jwks/example/by-kid",
+            services.KEYSET_REFRESH_COOLDOWN + services.KEYSET_STALE_TTL,
+        )
+
+        key = service._get_key("fake-key-id")
+        assert isinstance(key, PyJWK)
+        assert key.key_id == "fake-key-id"
+
+    def test_missing_key_ids(self, monkeypatch, mockredis):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        now = 1000.0
+        monkeypatch.setattr(services.time, "monotonic", lambda: now)
+        monkeypatch.setattr(services, "MISSING_KEY_IDS_MAXSIZE", 2)
+
+        service._set_missing_key_id("key-1")
+        assert service._is_missing_key_id("key-1")
+        assert not service._is_missing_key_id("key-2")
+
+        # Missing key IDs are forgotten once they expire...
+        now += services.MISSING_KEY_ID_TTL
+        assert not service._is_missing_key_id("key-1")
+
+        # ...or once too many have been remembered...
+        service._set_missing_key_id("key-2")
+        service._set_missing_key_id("key-3")
+        assert not service._is_missing_key_id("key-1")
+        assert not service._is_missing_key_id("key-2")
+        assert service._is_missing_key_id("key-3")
+
+        # ...or once a new keyset is stored.
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+        service._store_keyset({"key-3": {"foo": "bar"}})
+        assert not service._is_missing_key_id("key-3")
+
+    def test_get_key_local_cache(self, monkeypatch):
+        metrics = pretend.stub(increment=pretend.call_recorder(lambda *a, **kw: None))
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=metrics,
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        keyset = {
+            "fake-key-id": {
+                "kid": "fake-key-id",
+                "n": "ZHVtbXkK",
+                "kty": "RSA",
+                "alg": "RS256",
+                "e": "AQAB",
+                "use": "sig",
+                "x5c": ["dummy"],
+                "x5t": "dummy",
+            }
+        }
+        service._set_local_keyset(keyset)
+        monkeypatch.setattr(service, "_get_keyset", pretend.raiser(ValueError))
+
+        key = service._get_key("fake-key-id")
+        assert isinstance(key, PyJWK)
+        assert key.key_id == "fake-key-id"
+
+        assert metrics.increment.calls == []
+
+    def test_local_keyset_expires(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        now = 1000.0
+        monkeypatch.setattr(services.time, "monotonic", lambda: now)
+
+        keyset = {"fake-key-id": {"foo": "bar"}}
+        service._set_local_keyset(keyset)
+        assert service._get_local_keyset() == keyset
+
+        now += services.LOCAL_KEYSET_TTL
+        assert service._get_local_keyset() == {}
+
+    def test_get_keyset_populates_local_keyset(self, monkeypatch, mockredis):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url=pretend.stub(),
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        keyset = {"fake-key-id": {"foo": "bar"}}
+        service._store_keyset(keyset)
+        services.OIDCProviderService._local_keysets.clear()
+        assert service._get_local_keyset() == {}
+
+        service._get_keyset()
+        assert service._get_local_keyset() == keyset
+
+    def test_store_keyset_replaces_keys(self, monkeypatch, mockredis):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url=pretend.stub(),
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        service._store_keyset({"old-key-id": {"foo": "bar"}})
+        service._store_keyset({"new-key-id": {"foo": "baz"}})
+
+        keys, _, _ = service._get_keyset()
+        assert keys == {"new-key-id": {"foo": "baz"}}
+
+    def test_get_cached_key(self, monkeypatch, mockredis):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url=pretend.stub(),
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        monkeypatch.setattr(services.redis, "StrictRedis", mockredis)
+
+        assert service._get_cached_key("key-1") == (None, True)
+
+        keyset = {"key-1": {"foo": "bar"}, "key-2": {"foo": "baz"}}
+        service._store_keyset(keyset)
+        services.OIDCProviderService._local_keysets.clear()
+
+        assert service._get_cached_key("key-1") == ({"foo": "bar"}, False)
+        assert service._get_cached_key("key-3") == (None, False)
+        assert service._get_local_keyset() == {"key-1": {"foo": "bar"}}
+
+        # Keys fetched individually accumulate in the local keyset.
+        service._get_cached_key("key-2")
+        assert service._get_local_keyset() == keyset
+
+        mockredis.ttls["/warehouse/oidc/jwks/example/by-kid"] = 60
+        assert service._get_cached_key("key-1") == ({"foo": "bar"}, True)
+
+    def test_add_local_key_expired(self, monkeypatch):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url=pretend.stub(),
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        now = 1000.0
+        monkeypatch.setattr(services.time, "monotonic", lambda: now)
+        services.OIDCProviderService._local_keysets["example"] = (
+            {"key-1": {"foo": "bar"}},
+            now,
+        )
+
+        # An expired local keyset is replaced rather than added to.
+        service._add_local_key("key-2", {"foo": "baz"})
+        assert services.OIDCProviderService._local_keysets["example"] == (
+            {"key-2": {"foo": "baz"}},
+            now + services.LOCAL_KEYSET_TTL,
+        )
+
+    def test_build_pyjwk_reuses_keys(self):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        jwk = {
+            "kid": "fake-key-id",
+            "n": "ZHVtbXkK",
+            "kty": "RSA",
+            "alg": "RS256",
+            "e": "AQAB",
+            "use": "sig",
+            "x5c": ["dummy"],
+            "x5t": "dummy",
+        }
+
+        key = service._build_pyjwk("fake-key-id", jwk)
+        assert isinstance(key, PyJWK)
+        assert service._build_pyjwk("fake-key-id", dict(jwk)) is key
+
+        # A changed JWK under the same key ID is constructed anew.
+        rotated = service._build_pyjwk("fake-key-id", {**jwk, "n": "ZHVtbXkyCg"})
+        assert rotated is not key
+        assert service._build_pyjwk("fake-key-id", jwk) is not key
+
+    @pytest.mark.parametrize(
+        "header",
+        [
+            {"alg": "RS256", "kid": "fake-key-id"},
+            {"kid": "fake-key-id", "typ": "JWT"},
+        ],
+    )
+    def test_get_key_id_for_token(self, monkeypatch, header):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+        monkeypatch.setattr(
+            services.jwt, "get_unverified_header", pretend.raiser(ValueError)
+        )
+
+        token = (
+            base64.urlsafe_b64encode(orjson.dumps(header)).rstrip(b"=").decode()
+            + ".e30.c2lnbmF0dXJl"
+        )
+        assert service._get_key_id_for_token(token) == "fake-key-id"
+
+    @pytest.mark.parametrize(
+        "token",
+        [
+            "malformed-jwt",
+            "bm90IGpzb24.e30.c2lnbmF0dXJl",
+            "WyJub3QgYW4gb2JqZWN0Il0.e30.c2lnbmF0dXJl",
+            "eyJhbGciOiJSUzI1NiJ9.e30.c2lnbmF0dXJl",
+            "eyJraWQiOjF9.e30.c2lnbmF0dXJl",
+        ],
+    )
+    def test_get_key_id_for_token_falls_back(self, monkeypatch, token):
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+        monkeypatch.setattr(
+            services.jwt,
+            "get_unverified_header",
+            pretend.call_recorder(lambda token: {"kid": "fake-key-id"}),
+        )
+
+        assert service._get_key_id_for_token(token) == "fake-key-id"
+        assert services.jwt.get_unverified_header.calls == [pretend.call(token)]
+
+    def test_get_key_for_token(self, monkeypatch):
+        token = pretend.stub()
+        key = pretend.stub()
+
+        service = services.OIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+        monkeypatch.setattr(service, "_get_key", pretend.call_recorder(lambda kid: key))
+
+        monkeypatch.setattr(
+            services.jwt,
+            "get_unverified_header",
+            pretend.call_recorder(lambda token: {"kid": "fake-key-id"}),
+        )
+
+        assert service._get_key_for_token(token) == key
+        assert service._get_key.calls == [pretend.call("fake-key-id")]
+        assert services.jwt.get_unverified_header.calls == [pretend.call(token)]
 
 
 class TestNullOIDCProviderService:
@@ -609,6 +1590,8 @@ class TestNullOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         assert service is not None
@@ -628,6 +1611,8 @@ class TestNullOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         assert service.verify_jwt_signature("malformed-jwt") is None
@@ -655,6 +1640,8 @@ class TestNullOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         assert service.verify_jwt_signature(jwt) is None
@@ -684,10 +1671,32 @@ class TestNullOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         assert service.verify_jwt_signature(jwt) is None
 
+    def test_verify_jwt_signatures(self, monkeypatch):
+        service = services.NullOIDCProviderService(
+            session=pretend.stub(),
+            provider="example",
+            issuer_url="https://example.com",
+            cache_url="rediss://fake.example.com",
+            metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
+        )
+
+        claims = pretend.stub()
+        monkeypatch.setattr(
+            service,
+            "verify_jwt_signature",
+            lambda token: claims if token == "good-jwt" else None,
+        )
+
+        assert service.verify_jwt_signatures(["good-jwt", "bad-jwt"]) == [claims, None]
+
     def test_find_provider(self, monkeypatch):
         claims = {
             "iss": "foo",
@@ -703,6 +1712,8 @@ class TestNullOIDCProviderService:
             issuer_url="https://example.com",
             cache_url="rediss://fake.example.com",
             metrics=pretend.stub(),
+            http=pretend.stub(),
+            http_settings=pretend.stub(),
         )
 
         provider = pretend.stub(verify_claims=pretend.call_recorder(lambda c: True))
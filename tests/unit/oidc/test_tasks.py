@@ -0,0 +1,63 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pretend
+
+from warehouse.oidc import services, tasks
+from warehouse.oidc.interfaces import IOIDCProviderService
+
+
+def test_refresh_oidc_jwks(monkeypatch):
+    service = services.OIDCProviderService(
+        session=pretend.stub(),
+        provider="github",
+        issuer_url="https://example.com",
+        cache_url="rediss://fake.example.com",
+        metrics=pretend.stub(),
+        http=pretend.stub(),
+        http_settings=pretend.stub(),
+    )
+    monkeypatch.setattr(
+        service, "_refresh_stale_keyset", pretend.call_recorder(lambda: {})
+    )
+    request = pretend.stub(
+        find_service=pretend.call_recorder(lambda iface, name: service)
+    )
+
+    tasks.refresh_oidc_jwks(request)
+
+    assert request.find_service.calls == [
+        pretend.call(IOIDCProviderService, name="github")
+    ]
+    assert service._refresh_stale_keyset.calls == [pretend.call()]
+
+
+def test_refresh_oidc_jwks_null_service():
+    service = services.NullOIDCProviderService(
+        session=pretend.stub(),
+        provider="github",
+        issuer_url="https://example.com",
+        cache_url="rediss://fake.example.com",
+        metrics=pretend.stub(),
+        http=pretend.stub(),
+        http_settings=pretend.stub(),
+    )
+    request = pretend.stub(
+        find_service=pretend.call_recorder(lambda iface, name: service)
+    )
+
+    tasks.refresh_oidc_jwks(request)
+
+    assert request.find_service.calls == [
+        pretend.call(IOIDCProviderService, name="github")
+    ]
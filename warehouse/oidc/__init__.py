@@ -10,8 +10,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from celery.schedules import crontab
+
 from warehouse.oidc.interfaces import IOIDCProviderService
 from warehouse.oidc.services import OIDCProviderServiceFactory
+from warehouse.oidc.tasks import refresh_oidc_jwks
 from warehouse.oidc.utils import GITHUB_OIDC_ISSUER_URL
 
 
@@ -30,6 +33,10 @@ def includeme(config):
         name="github",
     )
 
+    # Keep each provider's keyset warm, so that JWT verification doesn't
+    # need to refresh it inline.
+    config.add_periodic_task(crontab(minute="*/5"), refresh_oidc_jwks)
+
     # During deployments, we separate auth routes into their own subdomain
     # to simplify caching exclusion.
     auth = config.get_settings().get("auth.domain")
@@ -32,6 +32,13 @@ class IOIDCProviderService(Interface):
         """
         pass
 
+    def verify_jwt_signatures(unverified_tokens: list[str]):
+        """
+        Verify each of the given JWTs' signatures as with `verify_jwt_signature`,
+        returning a list of their signed claims (or `None`) in the same order.
+        """
+        pass
+
     def find_provider(signed_claims: SignedClaims):
         """
         Given a mapping of signed claims produced by `verify_jwt_signature`,
@@ -10,10 +10,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import base64
+import functools
+import threading
+import time
 import warnings
 
+from types import MappingProxyType
+
 import jwt
+import msgpack
+import orjson
 import redis
 import requests
 import sentry_sdk
@@ -30,9 +37,88 @@ class InsecureOIDCProviderWarning(UserWarning):
     pass
 
 
+# How long (in seconds) after a refresh before a provider's keyset may be
+# refreshed again. Providers can extend this with `Cache-Control: max-age`
+# on their JWKS, up to `KEYSET_MAX_REFRESH_COOLDOWN`: a cooldown also delays
+# picking up newly rotated keys, so we don't let it grow unbounded.
+KEYSET_REFRESH_COOLDOWN = 60
+KEYSET_MAX_REFRESH_COOLDOWN = 5 * 60
+
+# How long (in seconds) a keyset stays cached in Redis once its refresh
+# cooldown has elapsed. Until then a keyset is trusted as-is, and only
+# refreshed when it's missing a key; this is a safety net that bounds how long
+# a keyset can go without being refetched. Once less than
+# `KEYSET_REVALIDATE_TTL` remains, the keyset is considered stale and is
+# refreshed in the background.
+KEYSET_STALE_TTL = 24 * 60 * 60
+KEYSET_REVALIDATE_TTL = 60 * 60
+
+# How long (in seconds) a key ID that couldn't be found, even after attempting
+# a refresh, is remembered as missing. At most `MISSING_KEY_IDS_MAXSIZE` key
+# IDs are remembered per provider.
+MISSING_KEY_ID_TTL = KEYSET_REFRESH_COOLDOWN
+MISSING_KEY_IDS_MAXSIZE = 1024
+
+# Connect and read timeouts (in seconds) for requests made to OIDC providers.
+HTTP_TIMEOUT = (3, 5)
+
+# The options we verify every JWT with.
+# NOTE: Many of these are defaults, but we set them explicitly to assert the
+# intended verification behavior.
+JWT_DECODE_OPTIONS = MappingProxyType(
+    dict(
+        verify_signature=True,
+        # "require" only checks for the presence of these claims, not
+        # their validity. Each has a corresponding "verify_" kwarg
+        # that enforces their actual validity.
+        require=["iss", "iat", "nbf", "exp", "aud"],
+        verify_iss=True,
+        verify_iat=True,
+        verify_nbf=True,
+        verify_exp=True,
+        verify_aud=True,
+    )
+)
+
+# How long (in seconds) a keyset read from Redis is reused from process
+# memory before going back to Redis.
+LOCAL_KEYSET_TTL = 30
+
+
+@functools.lru_cache
+def _redis_client(cache_url):
+    """
+    Return a process-wide Redis client for the given cache URL.
+
+    Redis clients are thread-safe and own a connection pool, so sharing a
+    single client avoids reconnecting to Redis on every keyset lookup.
+
+    NOTE: Replies are parsed with hiredis (one of our dependencies), which
+    redis-py selects automatically when it's installed.
+    """
+    return redis.StrictRedis.from_url(cache_url)
+
+
+def _refresh_cooldown(headers):
+    """
+    Return the refresh cooldown for a keyset served with the given response
+    headers, honoring the `max-age` directive of `Cache-Control` if present.
+    """
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.isascii() and value.isdigit():
+            return min(
+                max(int(value), KEYSET_REFRESH_COOLDOWN), KEYSET_MAX_REFRESH_COOLDOWN
+            )
+
+    return KEYSET_REFRESH_COOLDOWN
+
+
 @implementer(IOIDCProviderService)
 class NullOIDCProviderService:
-    def __init__(self, session, provider, issuer_url, cache_url, metrics):
+    def __init__(
+        self, session, provider, issuer_url, cache_url, metrics, http, http_settings
+    ):
         warnings.warn(
             "NullOIDCProviderService is intended only for use in development, "
             "you should not use it in production due to the lack of actual "
@@ -65,6 +151,11 @@ class NullOIDCProviderService:
         except jwt.PyJWTError:
             return None
 
+    def verify_jwt_signatures(
+        self, unverified_tokens: list[str]
+    ) -> list[SignedClaims | None]:
+        return [self.verify_jwt_signature(token) for token in unverified_tokens]
+
     def find_provider(self, signed_claims: SignedClaims) -> OIDCProvider | None:
         # NOTE: We do NOT verify the claims against the provider, since this
         # service is for development purposes only.
@@ -73,76 +164,245 @@ class NullOIDCProviderService:
 
 @implementer(IOIDCProviderService)
 class OIDCProviderService:
-    def __init__(self, session, provider, issuer_url, cache_url, metrics):
+    # A new service is created for each request, so the in-process keysets
+    # are shared at the class level: provider -> (keyset, expires_at)
+    _local_keysets: dict[str, tuple[dict, float]] = {}
+    _local_keysets_lock = threading.Lock()
+
+    # Constructing a PyJWK parses the underlying public key, so we keep the
+    # constructed keys around: (provider, key_id) -> (jwk, PyJWK)
+    _pyjwks: dict[tuple[str, str], tuple[dict, jwt.PyJWK]] = {}
+
+    # Unknown key IDs are cheap for a client to send, so we keep each process
+    # from turning them into repeated refreshes:
+    # provider -> {key_id: expires_at}, and provider -> last refresh attempt
+    _missing_key_ids: dict[str, dict[str, float]] = {}
+    _refresh_attempts: dict[str, float] = {}
+
+    # Held while this process is refreshing a provider's keyset, so that
+    # concurrent refreshes share a single fetch: provider -> lock
+    _refresh_locks: dict[str, threading.Lock] = {}
+
+    def __init__(
+        self, session, provider, issuer_url, cache_url, metrics, http, http_settings
+    ):
         self.db = session
         self.provider = provider
         self.issuer_url = issuer_url
         self.cache_url = cache_url
         self.metrics = metrics
 
-        self._provider_jwk_key = f"/warehouse/oidc/jwks/{self.provider}"
-        self._provider_timeout_key = f"{self._provider_jwk_key}/timeout"
+        # `http` is the request's HTTP session; refreshes made on other threads
+        # open sessions of their own, configured with `http_settings`.
+        self.http = http
+        self.http_settings = http_settings
+
+        # NOTE: Keysets are stored as a hash of key IDs to MessagePack-encoded
+        # keys; the key is named after the format so that processes still
+        # expecting a differently stored keyset never read it.
+        self._provider_jwk_key = f"/warehouse/oidc/jwks/{self.provider}/by-kid"
+        self._oidc_url = f"{self.issuer_url}/.well-known/openid-configuration"
+
+        self._decode_kwargs = dict(
+            algorithms=["RS256"],
+            options=JWT_DECODE_OPTIONS,
+            issuer=self.issuer_url,
+            audience="pypi",
+            leeway=30,
+        )
 
-    def _store_keyset(self, keys):
+    def _store_keyset(self, keys, cooldown=KEYSET_REFRESH_COOLDOWN):
         """
-        Store the given keyset for the given provider, setting the timeout key
-        in the process.
+        Store the given keyset for the given provider, indexed by key ID.
+
+        The keyset is stored with an expiry, the first `cooldown` seconds of
+        which act as the refresh timeout.
         """
 
-        with redis.StrictRedis.from_url(self.cache_url) as r:
-            r.set(self._provider_jwk_key, json.dumps(keys))
-            r.setex(self._provider_timeout_key, 60, "placeholder")
+        # The keyset is replaced as a whole, so that keys the provider has
+        # rotated out don't linger alongside the new ones.
+        with _redis_client(self.cache_url).pipeline() as p:
+            p.delete(self._provider_jwk_key)
+            p.hset(
+                self._provider_jwk_key,
+                mapping={
+                    key_id: msgpack.packb(key, use_bin_type=True)
+                    for key_id, key in keys.items()
+                },
+            )
+            p.expire(self._provider_jwk_key, cooldown + KEYSET_STALE_TTL)
+            p.execute()
+
+        self._set_local_keyset(keys)
+        self._missing_key_ids.pop(self.provider, None)
 
     def _get_keyset(self):
         """
         Return the cached keyset for the given provider, or an empty
-        keyset if no keys are currently cached.
+        keyset if no keys are currently cached, along with whether a refresh
+        timeout is currently in effect and whether the keyset is stale.
+        """
+
+        # The keyset and its remaining lifetime are fetched in a single
+        # round-trip.
+        with _redis_client(self.cache_url).pipeline(transaction=False) as p:
+            p.hgetall(self._provider_jwk_key)
+            p.ttl(self._provider_jwk_key)
+            keys, ttl = p.execute()
+
+        timeout = ttl > KEYSET_STALE_TTL
+        # NOTE: A TTL of -1 means the keyset has no expiry at all, in which
+        # case we treat it as stale so that a refresh gives it one.
+        stale = ttl < KEYSET_REVALIDATE_TTL
+        keys = {
+            key_id.decode(): msgpack.unpackb(key, raw=False, use_list=True)
+            for key_id, key in keys.items()
+        }
+        if keys:
+            self._set_local_keyset(keys)
+        return (keys, timeout, stale)
+
+    def _get_cached_key(self, key_id):
+        """
+        Return the cached JWK for the given key ID, or None if it isn't
+        cached, along with whether the keyset is stale.
         """
 
-        with redis.StrictRedis.from_url(self.cache_url) as r:
-            keys = r.get(self._provider_jwk_key)
-            timeout = bool(r.exists(self._provider_timeout_key))
-            if keys is not None:
-                return (json.loads(keys), timeout)
-            else:
-                return ({}, timeout)
+        # Only the requested key is fetched, rather than the whole keyset,
+        # since this runs on every JWT verification.
+        with _redis_client(self.cache_url).pipeline(transaction=False) as p:
+            p.hget(self._provider_jwk_key, key_id)
+            p.ttl(self._provider_jwk_key)
+            jwk, ttl = p.execute()
+
+        stale = ttl < KEYSET_REVALIDATE_TTL
+        if jwk is None:
+            return (None, stale)
+
+        jwk = msgpack.unpackb(jwk, raw=False, use_list=True)
+        self._add_local_key(key_id, jwk)
+        return (jwk, stale)
+
+    def _get_local_keyset(self):
+        """
+        Return the keyset held in process memory for the given provider, or
+        an empty keyset if none is held or it has expired.
+        """
+
+        with self._local_keysets_lock:
+            keys, expires_at = self._local_keysets.get(self.provider, ({}, 0.0))
+
+        if expires_at <= time.monotonic():
+            return {}
+        return keys
+
+    def _set_local_keyset(self, keys):
+        """
+        Hold the given keyset in process memory for the given provider,
+        for up to `LOCAL_KEYSET_TTL` seconds.
+        """
+
+        with self._local_keysets_lock:
+            self._local_keysets[self.provider] = (
+                keys,
+                time.monotonic() + LOCAL_KEYSET_TTL,
+            )
+
+    def _add_local_key(self, key_id, jwk):
+        """
+        Add the given JWK to the keyset held in process memory for the given
+        provider, holding a new keyset if none is held or it has expired.
+        """
+
+        now = time.monotonic()
+        with self._local_keysets_lock:
+            keys, expires_at = self._local_keysets.get(self.provider, ({}, 0.0))
+            if expires_at <= now:
+                keys, expires_at = {}, now + LOCAL_KEYSET_TTL
+            self._local_keysets[self.provider] = ({**keys, key_id: jwk}, expires_at)
+
+    def _refresh_lock(self):
+        """
+        Return the lock held while this process refreshes the given
+        provider's keyset.
+        """
+
+        return self._refresh_locks.setdefault(self.provider, threading.Lock())
 
     def _refresh_keyset(self):
         """
         Attempt to refresh the keyset from the OIDC provider, assuming no
         timeout is in effect.
 
+        If another thread in this process is already refreshing the keyset,
+        this waits for it to finish and returns the keyset it cached instead
+        of refreshing again.
+        """
+
+        lock = self._refresh_lock()
+        if not lock.acquire(blocking=False):
+            with lock:
+                pass
+            keys, _, _ = self._get_keyset()
+            return keys
+
+        try:
+            return self._fetch_keyset()
+        finally:
+            lock.release()
+
+    def _fetch_keyset(self, http=None):
+        """
+        Fetch and cache the keyset from the OIDC provider, assuming no
+        timeout is in effect, using the given HTTP session or the request's.
+
         Returns the refreshed keyset, or the cached keyset if a timeout is
-        in effect.
+        in effect. In addition to the shared timeout, each process attempts
+        at most one refresh per `KEYSET_REFRESH_COOLDOWN` seconds, whether or
+        not that attempt succeeds.
 
         Returns the cached keyset on any provider access or format errors.
         """
 
         # Fast path: we're in a cooldown from a previous refresh.
-        keys, timeout = self._get_keyset()
-        if timeout:
+        keys, timeout, _ = self._get_keyset()
+        now = time.monotonic()
+        last_attempt = self._refresh_attempts.get(self.provider)
+        if timeout or (
+            last_attempt is not None and now - last_attempt < KEYSET_REFRESH_COOLDOWN
+        ):
             self.metrics.increment(
                 "warehouse.oidc.refresh_keyset.timeout",
                 tags=[f"provider:{self.provider}"],
             )
             return keys
 
-        oidc_url = f"{self.issuer_url}/.well-known/openid-configuration"
+        self._refresh_attempts[self.provider] = now
 
-        resp = requests.get(oidc_url)
+        if http is None:
+            http = self.http
 
         # For whatever reason, an OIDC provider's configuration URL might be
         # offline. We don't want to completely explode here, since other
         # providers might still be online (and need updating), so we spit
         # out an error and return None instead of raising.
+        try:
+            resp = http.get(self._oidc_url, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as exc:
+            sentry_sdk.capture_message(
+                f"OIDC provider {self.provider} failed to return configuration: "
+                f"{self._oidc_url} ({exc})"
+            )
+            return keys
+
         if not resp.ok:
             sentry_sdk.capture_message(
                 f"OIDC provider {self.provider} failed to return configuration: "
-                f"{oidc_url}"
+                f"{self._oidc_url}"
             )
             return keys
 
-        oidc_conf = resp.json()
+        oidc_conf = orjson.loads(resp.content)
         jwks_url = oidc_conf.get("jwks_uri")
 
         # A valid OIDC configuration MUST have a `jwks_uri`, but we
@@ -154,9 +414,16 @@ class OIDCProviderService:
             )
             return keys
 
-        resp = requests.get(jwks_url)
-
         # Same reasoning as above.
+        try:
+            resp = http.get(jwks_url, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as exc:
+            sentry_sdk.capture_message(
+                f"OIDC provider {self.provider} failed to return JWKS JSON: "
+                f"{jwks_url} ({exc})"
+            )
+            return keys
+
         if not resp.ok:
             sentry_sdk.capture_message(
                 f"OIDC provider {self.provider} failed to return JWKS JSON: "
@@ -164,7 +431,7 @@ class OIDCProviderService:
             )
             return keys
 
-        jwks_conf = resp.json()
+        jwks_conf = orjson.loads(resp.content)
         new_keys = jwks_conf.get("keys")
 
         # Another sanity test: an OIDC provider should never return an empty
@@ -178,26 +445,148 @@ class OIDCProviderService:
             return keys
 
         keys = {key["kid"]: key for key in new_keys}
-        self._store_keyset(keys)
+        self._store_keyset(keys, cooldown=_refresh_cooldown(resp.headers))
 
         return keys
 
+    def _refresh_stale_keyset(self):
+        """
+        Attempt to refresh the keyset from the OIDC provider if the cached
+        keyset is missing or stale, returning the (possibly refreshed) keyset.
+        """
+
+        keys, _, stale = self._get_keyset()
+        if stale:
+            keys = self._refresh_keyset()
+        return keys
+
+    def _refresh_keyset_in_background(self):
+        """
+        Attempt to refresh the keyset from the OIDC provider on a background
+        thread, unless this process is already doing so.
+        """
+
+        lock = self._refresh_lock()
+        if not lock.acquire(blocking=False):
+            return
+
+        def _refresh():
+            try:
+                # The request's HTTP session isn't guaranteed to be
+                # thread-safe, so this thread uses a session of its own.
+                with requests.Session() as http:
+                    for attr, val in (self.http_settings or {}).items():
+                        setattr(http, attr, val)
+                    self._fetch_keyset(http=http)
+            except Exception:
+                # Nothing is waiting on this thread, so any failure would
+                # otherwise go unreported.
+                sentry_sdk.capture_exception()
+            finally:
+                lock.release()
+
+        # The cached keyset is still usable, so failing to start a refresh
+        # shouldn't fail the caller; a later lookup will try again.
+        try:
+            threading.Thread(target=_refresh, daemon=True).start()
+        except RuntimeError:
+            lock.release()
+            sentry_sdk.capture_exception()
+
     def _get_key(self, key_id):
         """
         Return a JWK for the given key ID, or None if the key can't be found
         in this provider's keyset.
         """
 
-        keyset, _ = self._get_keyset()
+        # Fast path: the key is in a keyset we've recently seen, so we don't
+        # need to go to Redis at all.
+        keyset = self._get_local_keyset()
         if key_id not in keyset:
+            jwk, stale = self._get_cached_key(key_id)
+            if jwk is not None:
+                keyset = {key_id: jwk}
+                # Stale-while-revalidate: the cached keyset is nearing its
+                # expiry, so we use it as-is and refresh it in the background
+                # rather than making this request wait on the provider.
+                if stale:
+                    self._refresh_keyset_in_background()
+
+        # NOTE: A key ID recently found missing is still looked up in Redis
+        # above, since another process may have since refreshed the keyset;
+        # we only skip refreshing it again ourselves.
+        if key_id not in keyset and not self._is_missing_key_id(key_id):
             keyset = self._refresh_keyset()
+            if key_id not in keyset:
+                self._set_missing_key_id(key_id)
+
         if key_id not in keyset:
             self.metrics.increment(
                 "warehouse.oidc.get_key.error",
                 tags=[f"provider:{self.provider}", f"key_id:{key_id}"],
             )
             return None
-        return jwt.PyJWK(keyset[key_id])
+        return self._build_pyjwk(key_id, keyset[key_id])
+
+    def _is_missing_key_id(self, key_id):
+        """
+        Return whether the given key ID was recently found to be missing from
+        this provider's keyset, even after attempting a refresh.
+        """
+
+        expires_at = self._missing_key_ids.get(self.provider, {}).get(key_id)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def _set_missing_key_id(self, key_id):
+        """
+        Remember the given key ID as missing from this provider's keyset for
+        `MISSING_KEY_ID_TTL` seconds.
+        """
+
+        missing = self._missing_key_ids.setdefault(self.provider, {})
+        if len(missing) >= MISSING_KEY_IDS_MAXSIZE:
+            missing.clear()
+        missing[key_id] = time.monotonic() + MISSING_KEY_ID_TTL
+
+    def _build_pyjwk(self, key_id, jwk):
+        """
+        Return a `jwt.PyJWK` for the given JWK, reusing a previously
+        constructed one if the JWK hasn't changed since.
+        """
+
+        cache_key = (self.provider, key_id)
+        cached = self._pyjwks.get(cache_key)
+        if cached is not None and cached[0] == jwk:
+            return cached[1]
+
+        key = jwt.PyJWK(jwk)
+        self._pyjwks[cache_key] = (jwk, key)
+        return key
+
+    def _get_key_id_for_token(self, token):
+        """
+        Return the ID of the key that the given JWT claims to be signed with.
+
+        The JWT is not verified at this point, and this step happens
+        prior to any verification.
+        """
+
+        # Fast path: decode the header segment directly, rather than going
+        # through pyjwt's more general parsing. Anything unexpected about the
+        # header is left for pyjwt to handle (or reject).
+        try:
+            header_segment = token.split(".", 1)[0]
+            unverified_header = orjson.loads(
+                base64.urlsafe_b64decode(header_segment + "==")
+            )
+            key_id = unverified_header["kid"]
+            if isinstance(key_id, str):
+                return key_id
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+
+        unverified_header = jwt.get_unverified_header(token)
+        return unverified_header["kid"]
 
     def _get_key_for_token(self, token):
         """
@@ -206,34 +595,45 @@ class OIDCProviderService:
         The JWT is not verified at this point, and this step happens
         prior to any verification.
         """
-        unverified_header = jwt.get_unverified_header(token)
-        return self._get_key(unverified_header["kid"])
+        return self._get_key(self._get_key_id_for_token(token))
 
     def verify_jwt_signature(self, unverified_token: str) -> SignedClaims | None:
         key = self._get_key_for_token(unverified_token)
+        return self._verify_jwt_signature_with_key(unverified_token, key)
+
+    def verify_jwt_signatures(
+        self, unverified_tokens: list[str]
+    ) -> list[SignedClaims | None]:
+        # Tokens in a batch are typically all signed with the same key, so
+        # each key is only looked up once per batch.
+        keys: dict[str, jwt.PyJWK | None] = {}
+        signed_claims: list[SignedClaims | None] = []
+        for unverified_token in unverified_tokens:
+            # A malformed token only fails its own verification, rather than
+            # the rest of the batch.
+            try:
+                key_id = self._get_key_id_for_token(unverified_token)
+            except (jwt.PyJWTError, KeyError):
+                self.metrics.increment(
+                    "warehouse.oidc.verify_jwt_signature.invalid_signature",
+                    tags=[f"provider:{self.provider}"],
+                )
+                signed_claims.append(None)
+                continue
 
+            if key_id not in keys:
+                keys[key_id] = self._get_key(key_id)
+            signed_claims.append(
+                self._verify_jwt_signature_with_key(unverified_token, keys[key_id])
+            )
+        return signed_claims
+
+    def _verify_jwt_signature_with_key(
+        self, unverified_token: str, key
+    ) -> SignedClaims | None:
         try:
-            # NOTE: Many of the keyword arguments here are defaults, but we
-            # set them explicitly to assert the intended verification behavior.
             signed_payload = jwt.decode(
-                unverified_token,
-                key=key,
-                algorithms=["RS256"],
-                options=dict(
-                    verify_signature=True,
-                    # "require" only checks for the presence of these claims, not
-                    # their validity. Each has a corresponding "verify_" kwarg
-                    # that enforces their actual validity.
-                    require=["iss", "iat", "nbf", "exp", "aud"],
-                    verify_iss=True,
-                    verify_iat=True,
-                    verify_nbf=True,
-                    verify_exp=True,
-                    verify_aud=True,
-                ),
-                issuer=self.issuer_url,
-                audience="pypi",
-                leeway=30,
+                unverified_token, key=key, **self._decode_kwargs
             )
             return SignedClaims(signed_payload)
         except Exception as e:
@@ -284,20 +684,31 @@ class OIDCProviderServiceFactory:
         self.issuer_url = issuer_url
         self.service_class = service_class
 
+        self._key = (provider, issuer_url, service_class)
+        self._hash = hash(self._key)
+
     def __call__(self, _context, request):
         cache_url = request.registry.settings["oidc.jwk_cache_url"]
         metrics = request.find_service(IMetricsService, context=None)
 
         return self.service_class(
-            request.db, self.provider, self.issuer_url, cache_url, metrics
+            request.db,
+            self.provider,
+            self.issuer_url,
+            cache_url,
+            metrics,
+            request.http,
+            request.registry.settings.get("http"),
         )
 
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
+        if self is other:
+            return True
+
         if not isinstance(other, OIDCProviderServiceFactory):
             return NotImplemented
 
-        return (self.provider, self.issuer_url, self.service_class) == (
-            other.provider,
-            other.issuer_url,
-            other.service_class,
-        )
+        return self._key == other._key
@@ -0,0 +1,34 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from warehouse import tasks
+from warehouse.oidc.interfaces import IOIDCProviderService
+from warehouse.oidc.services import OIDCProviderService
+
+
+@tasks.task(ignore_result=True, acks_late=True)
+def refresh_oidc_jwks(request):
+    """
+    Refresh the cached keyset of each OIDC provider ahead of its expiry, so
+    that verifying a JWT rarely has to wait on the provider itself.
+
+    Keysets that aren't stale are left alone: they're refreshed when a JWT
+    arrives with an unknown key ID, not on a timer.
+    """
+
+    # NOTE: GitHub is currently our only OIDC provider.
+    service = request.find_service(IOIDCProviderService, name="github")
+
+    # Only the real service has a keyset to refresh; the null service used
+    # in development doesn't verify signatures at all.
+    if isinstance(service, OIDCProviderService):
+        service._refresh_stale_keyset()
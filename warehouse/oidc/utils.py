@@ -45,6 +45,10 @@ def find_provider_by_issuer(
         workflow_prefix = f"{repository}/.github/workflows/"
         workflow_ref = signed_claims["job_workflow_ref"].removeprefix(workflow_prefix)
 
+        # NOTE: The equality filters here are served by the index backing
+        # `_github_oidc_provider_uc` (repository_name, repository_owner, ...),
+        # leaving only the few rows for a single repository to be checked
+        # against the owner ID and workflow.
         return (
             session.query(GitHubProvider)
             .filter_by(